@@ -1,10 +1,14 @@
 import io
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import TYPE_CHECKING, Tuple, Optional
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import streamlit as st
+import xxhash
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
 
 # ---------- Page config ----------
 st.set_page_config(
@@ -13,17 +17,24 @@ st.set_page_config(
     layout="centered",
 )
 
+# Caches are shared by every session; bound them so uploads don't accumulate
+# in server memory for its whole lifetime.
+CACHE_MAX_ENTRIES = 8
+
 # ---------- Helpers ----------
-def parse_numeric(value) -> Tuple[bool, Optional[float], Optional[str]]:
-    if pd.isna(value):
-        return False, None, "empty"
-    try:
-        num = float(str(value).strip())
-    except ValueError:
-        return False, None, "non-numeric"
-    if num == 0:
-        return False, None, "zero"
-    return True, num, None
+def classify_column(s: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """Coerce a column to numbers and tag each cell that can't be plotted.
+
+    Returns ``(num, reason)`` where ``reason`` is ``"empty"``, ``"non-numeric"``
+    or ``"zero"`` for unusable cells and ``<NA>`` for valid ones.
+    """
+    stripped = s.astype("string").str.strip()
+    num = pd.to_numeric(stripped, errors="coerce")
+    reason = pd.Series(pd.NA, index=s.index, dtype="string")
+    reason[(s.isna() | (stripped == "")).fillna(True)] = "empty"
+    reason[num.isna() & reason.isna()] = "non-numeric"
+    reason[(num == 0).fillna(False)] = "zero"
+    return num, reason
 
 def validate_and_prepare(df: pd.DataFrame) -> Tuple[int, int, Optional[int]]:
     if not isinstance(df, pd.DataFrame):
@@ -38,61 +49,140 @@ def validate_and_prepare(df: pd.DataFrame) -> Tuple[int, int, Optional[int]]:
     ix_label = cols.index("labels") if "labels" in cols else None
     return ix_in, ix_out, ix_label
 
+def new_scatter_figure(dpi: int) -> "Figure":
+    # matplotlib is imported here, not at module level, so sessions that never
+    # plot don't pay its import cost.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    # Plain Figure on an Agg canvas (not plt.subplots) so it isn't tracked by
+    # pyplot's global figure manager and is freed once rendered.
+    fig = Figure(figsize=(6, 4), dpi=dpi)
+    FigureCanvasAgg(fig)
+    fig.add_subplot()
+    return fig
+
+def draw_scatter(fig: "Figure", x_vals: np.ndarray, y_vals: np.ndarray) -> "Figure":
+    ax = fig.axes[0]
+    # Rasterize the markers so large point counts don't become one path each
+    ax.scatter(x_vals, y_vals, s=12, rasterized=True, marker="o", linewidths=0)
+    ax.set_xlabel("inputs")
+    ax.set_ylabel("outputs")
+    ax.set_title("Scatter Plot of inputs vs outputs")
+    ax.grid(True)
+    ax.set_axisbelow(True)
+    fig.tight_layout()
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def render_scatter_png(
+    file_key: str, _x_vals: np.ndarray, _y_vals: np.ndarray, dpi: int = 300
+) -> bytes:
+    """Render the scatter plot of an upload to PNG bytes.
+
+    Keyed on the upload's ``file_key`` rather than the point arrays, so a
+    cache hit costs nothing proportional to the number of points.
+    """
+    fig = draw_scatter(new_scatter_figure(dpi), _x_vals, _y_vals)
+    buf = io.BytesIO()
+    # Straight to the Agg canvas: skips savefig's backend/dpi/bbox handling
+    fig.canvas.print_png(buf)
+    return buf.getvalue()
+
+def file_cache_key(file_bytes: bytes) -> str:
+    # xxh3 hashes at memory speed; Streamlit's default (blake2b) is far slower
+    # on multi-MB uploads and would run on every rerun.
+    return xxhash.xxh3_128_hexdigest(file_bytes)
+
+def read_csv_text(file_bytes: bytes) -> pd.DataFrame:
+    # Every column as text: classify_column does the numeric coercion itself,
+    # and the download keeps the other columns as uploaded. Both the analysis
+    # and the download parse through here, so they agree on what is valid.
+    return pd.read_csv(io.BytesIO(file_bytes), engine="c", dtype=str)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_and_classify(
+    file_key: str,
+    _file_bytes: bytes,
+) -> Tuple[
+    np.ndarray, np.ndarray, np.ndarray, Tuple[np.ndarray, np.ndarray, np.ndarray]
+]:
+    """Parse, validate and classify an uploaded CSV.
+
+    Cached on ``file_key`` (see ``file_cache_key``), so reruns triggered by
+    widgets don't re-parse the file; the bytes themselves are excluded from
+    Streamlit's hashing. Raises ``ValueError`` with a user-facing message.
+    """
+    try:
+        df = read_csv_text(_file_bytes)
+    except Exception:
+        raise ValueError("The file is not a valid .csv (parse error).")
+    ix_in, ix_out, ix_label = validate_and_prepare(df)
+
+    in_num, in_reason = classify_column(df["inputs"])
+    out_num, out_reason = classify_column(df["outputs"])
+
+    valid = in_reason.isna() & out_reason.isna()
+
+    x_vals: np.ndarray = in_num[valid].to_numpy(dtype=float)
+    y_vals: np.ndarray = out_num[valid].to_numpy(dtype=float)
+
+    # keep adj_outputs aligned with DataFrame (NaN for skipped rows)
+    adj_outputs: np.ndarray = (out_num.where(valid) * 1.6).to_numpy(
+        dtype=float, na_value=np.nan
+    )
+
+    # Skipped rows: gathered only for ~valid
+    bad = np.flatnonzero(~valid.to_numpy())
+    if ix_label is not None:
+        labels_bad = (
+            df["labels"].iloc[bad].astype("string").str.strip().fillna("").to_numpy()
+        )
+    else:
+        labels_bad = np.full(len(bad), "", dtype=object)
+    # e.g. "inputs is empty; outputs is zero", built for skipped rows only
+    msg_in = ("inputs is " + in_reason.iloc[bad]).fillna("")
+    msg_out = ("outputs is " + out_reason.iloc[bad]).fillna("")
+    combined = msg_in.str.cat(msg_out, sep="; ").str.strip("; ")
+
+    # Skipped rows as parallel arrays: (row numbers, labels, reasons)
+    skipped = (
+        df.index.to_numpy()[bad] + 2,  # header row = 1
+        labels_bad,
+        combined.to_numpy(),
+    )
+
+    return adj_outputs, x_vals, y_vals, skipped
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def build_updated_csv(file_key: str, _file_bytes: bytes) -> bytes:
+    """Return the uploaded CSV with the adj_outputs column appended.
+
+    The file is parsed again rather than cached as a DataFrame, since this
+    only runs when the download is requested.
+    """
+    adj_outputs, _, _, _ = load_and_classify(file_key, _file_bytes)
+    full = read_csv_text(_file_bytes)
+    full["adj_outputs"] = adj_outputs
+    return full.to_csv(index=False).encode()
+
 # ---------- Main UI ----------
 uploaded = st.file_uploader("Choose CSV file", type=["csv"])
 if not uploaded:
     st.info("Awaiting upload…")
     st.stop()
 
-# Step 1: Load and validate
+# Step 1 + 2: Load, validate and process rows (count valid/invalid + prepare adj_outputs)
+raw = uploaded.getvalue()
+raw_key = file_cache_key(raw)
 try:
-    df = pd.read_csv(uploaded)
-except Exception:
-    st.error("The file is not a valid .csv (parse error).")
-    st.stop()
-
-try:
-    ix_in, ix_out, ix_label = validate_and_prepare(df)
+    _, x_vals, y_vals, skipped = load_and_classify(raw_key, raw)
 except ValueError as e:
     st.error(str(e))
     st.stop()
 
-# Step 2: Process rows (count valid/invalid + prepare adj_outputs)
-x_vals: List[float] = []
-y_vals: List[float] = []
-skipped: List[Tuple[int, str, List[str]]] = []
-
-adj_outputs: List[Optional[float]] = []
-
-for i, row in df.iterrows():
-    row_number = i + 2  # header row = 1
-    label = ""
-    if ix_label is not None:
-        maybe = row.iloc[ix_label]
-        if pd.notna(maybe):
-            label = str(maybe).strip()
-
-    in_ok, in_num, in_reason = parse_numeric(row.iloc[ix_in])
-    out_ok, out_num, out_reason = parse_numeric(row.iloc[ix_out])
-
-    if in_ok and out_ok:
-        x_vals.append(in_num)  # type: ignore[arg-type]
-        y_vals.append(out_num)  # type: ignore[arg-type]
-        adj_outputs.append(out_num * 1.6)
-    else:
-        reasons = []
-        if not in_ok:
-            reasons.append(f"inputs is {in_reason}")
-        if not out_ok:
-            reasons.append(f"outputs is {out_reason}")
-        skipped.append((row_number, label, reasons))
-        # keep adj_outputs aligned with DataFrame
-        adj_outputs.append(None)
-
-df["adj_outputs"] = adj_outputs
-
 valid_count = len(x_vals)
-invalid_count = len(skipped)
+invalid_count = len(skipped[0])
 
 # Step 3: Show metrics (as badges/cards)
 c1, c2 = st.columns(2)
@@ -114,29 +204,32 @@ for c, title, value in [
         )
 
 # Step 4: Download updated CSV
-csv_buf = io.BytesIO()
-df.to_csv(csv_buf, index=False)
-csv_buf.seek(0)
 st.download_button(
     "Download updated CSV (with adj_outputs)",
-    csv_buf,
+    lambda: build_updated_csv(raw_key, raw),  # built only on click
     file_name="updated_with_adj_outputs.csv",
     mime="text/csv"
 )
 
+# Nothing to plot: skip the plot button and rendering altogether
+if valid_count == 0:
+    st.warning("No valid numeric (inputs, outputs) pairs to plot.")
+    st.stop()
+
 # Step 5: Proceed button
 if st.button("Proceed to plotting"):
     st.subheader("Scatter plot (inputs vs outputs)")
-    fig, ax = plt.subplots()
-    ax.scatter(x_vals, y_vals)
-    ax.set_xlabel("inputs")
-    ax.set_ylabel("outputs")
-    ax.set_title("Scatter Plot of inputs vs outputs")
-    ax.grid(True)
-    st.pyplot(fig, clear_figure=True)
-
-    # Optionally: download the PNG
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=300, bbox_inches="tight")
-    buf.seek(0)
-    st.download_button("Download plot (PNG)", buf, file_name="output.png", mime="image/png")
+    # Served as a cached PNG, so reruns don't touch matplotlib at all. Same
+    # size and sharpness as st.pyplot's defaults (dpi=200, full column width).
+    st.image(render_scatter_png(raw_key, x_vals, y_vals, dpi=200), width="stretch")
+
+    # Optionally: download the PNG (full resolution, rendered only on click)
+    st.download_button(
+        "Download plot (PNG)",
+        lambda: render_scatter_png(raw_key, x_vals, y_vals),
+        file_name="output.png",
+        mime="image/png",
+        # No rerun: the button lives under "Proceed to plotting", which would
+        # read False on the rerun and drop the deferred file before it's fetched
+        on_click="ignore",
+    )